@@ -70,6 +70,22 @@ class MedlemInline(admin.StackedInline):
     can_delete = False
 
 
+@admin.register(VervInnehavelse)
+class VervInnehavelseAdmin(admin.ModelAdmin):
+    # select_related så changelist og skjema ikke henter relasjonan per rad
+    list_select_related = ['medlem', 'verv__kor']
+
+
+@admin.register(DekorasjonInnehavelse)
+class DekorasjonInnehavelseAdmin(admin.ModelAdmin):
+    list_select_related = ['medlem', 'dekorasjon__kor']
+
+
+@admin.register(Oppmøte)
+class OppmøteAdmin(admin.ModelAdmin):
+    list_select_related = ['medlem', 'hendelse__kor']
+
+
 # Re-register UserAdmin
 admin.site.unregister(User)
 @admin.register(User)
@@ -82,4 +98,4 @@ class CustomUserAdmin(UserAdmin):
 
 
 # Register øverige modeller vi ikkje treng å gjør nå med
-admin.site.register([Kor, VervInnehavelse, DekorasjonInnehavelse, LoggM2M, Oppmøte, Lenke])
+admin.site.register([Kor, LoggM2M, Lenke])
@@ -1,35 +1,69 @@
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 from django.db.models import Exists, OuterRef
 
-from mytxs.models import Logg, Medlem, Oppmøte
-from mytxs.utils.modelUtils import stemmegruppeVerv, vervInnehavelseAktiv
+from mytxs.models import Hendelse, Logg, Medlem, Oppmøte
+from mytxs.utils.modelUtils import aktiveStemmegruppeMedlemmer
 from mytxs.utils.utils import getHalvårStart
 
+# Hvor mange oppmøter vi sletter per transaksjon. Begrenser både minnebruk og hvor lenge vi holder radlåser.
+BATCH_SIZE = 5000
+
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
-        # Skaff oppmøtene til sluttede korister
-        sluttedeKoristerOppmøter = Oppmøte.objects.exclude(
-            Exists(Medlem.objects.filter(
-                vervInnehavelseAktiv(),
-                stemmegruppeVerv('vervInnehavelser__verv', includeDirr=True),
+        loggModel = Oppmøte.__name__
+
+        # Skaff oppmøtene til sluttede korister. Annotate + filter istedenfor exclude(Exists(...))
+        # gjør at Postgres kan kjøre en enkelt anti-join istedenfor en korrelert subquery per rad.
+        sluttedeKoristerOppmøter = Oppmøte.objects.annotate(
+            harAktivKorist=Exists(Medlem.objects.filter(
+                aktiveStemmegruppeMedlemmer(includeDirr=True),
                 oppmøter=OuterRef('pk')
-            ))
-        )
+            ).values('pk'))
+        ).filter(harAktivKorist=False)
+
+        # Slett logger og oppmøter i batches, slik at vi verken trenger hele settet i minnet på en
+        # gang eller holder radlåser lenger enn en batch av gangen. _raw_delete hopper over Django
+        # sin Collector, som ellers hadde hentet alle PKene inn i minnet og fyrt av signals.
+        # Ingenting CASCADEr fra disse loggene (Oppmøte har ingen M2M fields, så LoggM2M referere
+        # aldri til Oppmøte-logger), ingen modeller har FK til Oppmøte, og vi vil ikke at
+        # logSignals skal logge selve opprydningen.
+        # Materialiser PKene en gang, så den dyre anti-joinen bare kjøres en gang istedenfor per batch.
+        sluttedePks = list(sluttedeKoristerOppmøter.values_list('pk', flat=True))
 
-        # Slett logger
-        Logg.objects.filter(model=Oppmøte.__name__, instancePK__in=sluttedeKoristerOppmøter).delete()
+        for i in range(0, len(sluttedePks), BATCH_SIZE):
+            batch = sluttedePks[i:i+BATCH_SIZE]
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Om en batch mot formodning henger, abort heller enn å holde låser i det uendelige
+                cursor.execute("SET LOCAL statement_timeout = '60s'")
 
-        # Slett oppmøtene
-        sluttedeKoristerOppmøter.delete()
+                batchLogger = Logg.objects.filter(model=loggModel, instancePK__in=batch)
+                batchLogger._raw_delete(batchLogger.db)
+
+                batchOppmøter = Oppmøte.objects.filter(pk__in=batch)
+                batchOppmøter._raw_delete(batchOppmøter.db)
 
         # Skaff oppmøter fra tidligere semestre
-        tidligereSemestreOppmøter = Oppmøte.objects.filter(
-            hendelse__startDate__lt=getHalvårStart()
-        )
+        halvårStart = getHalvårStart()
+        tidligereSemestreOppmøter = Oppmøte.objects.filter(hendelse__startDate__lt=halvårStart)
+
+        # Typisk etter andre kjøring samme semester er det ingenting igjen å rydde
+        if not tidligereSemestreOppmøter.exists():
+            return
 
-        # Slett logger
-        Logg.objects.filter(model=Oppmøte.__name__, instancePK__in=tidligereSemestreOppmøter).delete()
+        # Slett logger med en server-side JOIN, istedenfor å dra Oppmøte-PKene innom Python og
+        # sende de tilbake i en diger IN-liste. Postgres planlegger dette som en enkelt hash-join DELETE.
+        # Atomic gjør at vi aldri står igjen med slettede logger men beholdte meldinger om noe krasjer.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = '60s'")
+            cursor.execute(f'''
+                DELETE FROM {Logg._meta.db_table} logg
+                USING {Oppmøte._meta.db_table} oppmøte
+                JOIN {Hendelse._meta.db_table} hendelse ON oppmøte.hendelse_id = hendelse.id
+                WHERE logg.model = %s AND logg."instancePK" = oppmøte.id AND hendelse."startDate" < %s
+            ''', [loggModel, halvårStart])
 
-        # Slett fraværsmeldingan
-        tidligereSemestreOppmøter.update(melding='')
+            # Slett fraværsmeldingan. Exclude gjør at vi ikke skriver om igjen rader som allerede
+            # er tomme, som typisk er de fleste fra tidligere semestre.
+            tidligereSemestreOppmøter.exclude(melding='').update(melding='')
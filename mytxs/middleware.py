@@ -1,9 +1,23 @@
+import datetime
 import threading
 
 from mytxs.forms import addInnstillingerForm
+from mytxs.utils.modelUtils import todayVar
 from mytxs.utils.threadUtils import THREAD_LOCAL
 
 
+def TodayMiddleware(get_response):
+    'Sett dagens dato en gang per request, så alle tilgangsqueryan dele dato (også over midnatt)'
+    def middleware(request):
+        token = todayVar.set(datetime.date.today())
+        try:
+            return get_response(request)
+        finally:
+            todayVar.reset(token)
+
+    return middleware
+
+
 def OptionFormMiddleware(get_response):
     'Om brukeren er innlogget, hiv på optionForm og sjekk for submit'
     def middleware(request):
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-08-29 05:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0019_dekorasjon_ikon_dekorasjon_overvalør'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logg',
+            index=models.Index(fields=['model', 'instancePK'], name='logg_model_instance_idx'),
+        ),
+    ]
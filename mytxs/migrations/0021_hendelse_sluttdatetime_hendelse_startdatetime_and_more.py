@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-08-29 05:23
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F
+from django.db.models.functions import Coalesce
+
+
+def backfillDatetime(apps, schema_editor):
+    'Fyll inn de nye kolonnene for eksisterende hendelser, databasesiden gjør jobben'
+    Hendelse = apps.get_model('mytxs', 'Hendelse')
+    Hendelse.objects.filter(startTime__isnull=False).update(
+        startDatetime=ExpressionWrapper(F('startDate') + F('startTime'), output_field=models.DateTimeField()),
+        sluttDatetime=ExpressionWrapper(Coalesce('sluttDate', 'startDate') + F('sluttTime'), output_field=models.DateTimeField())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0020_logg_logg_model_instance_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hendelse',
+            name='sluttDatetime',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='hendelse',
+            name='startDatetime',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='hendelse',
+            index=models.Index(fields=['kor', 'kategori', 'startDate'], name='hendelse_kor_kat_start_idx'),
+        ),
+        migrations.RunPython(backfillDatetime, migrations.RunPython.noop),
+    ]
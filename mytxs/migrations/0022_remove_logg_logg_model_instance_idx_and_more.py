@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-08-29 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0021_hendelse_sluttdatetime_hendelse_startdatetime_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='logg',
+            name='logg_model_instance_idx',
+        ),
+        migrations.AddIndex(
+            model_name='logg',
+            index=models.Index(fields=['model', 'instancePK', 'timeStamp'], name='logg_model_pk_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-08-29 05:24
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0022_remove_logg_logg_model_instance_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logg',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['value'], name='logg_value_gin', opclasses=['jsonb_path_ops']),
+        ),
+    ]
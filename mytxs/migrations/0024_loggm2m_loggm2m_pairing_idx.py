@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-08-29 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0023_logg_logg_value_gin'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loggm2m',
+            index=models.Index(fields=['fromLogg', 'toLogg', 'm2mName', 'change', 'timeStamp'], name='loggm2m_pairing_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-08-29 05:29
+
+from django.db import migrations, models
+
+from mytxs import consts
+
+
+def backfillSortOrder(apps, schema_editor):
+    'Fyll inn sorteringsrekkefølgen for eksisterende kor, samme logikk som Kor.save()'
+    Kor = apps.get_model('mytxs', 'Kor')
+    for kor in Kor.objects.all():
+        kor.sortOrder = consts.bareKorNavn.index(kor.navn) if kor.navn in consts.bareKorNavn else len(consts.bareKorNavn)
+        kor.sortOrderTKS = consts.bareKorNavnTKSRekkefølge.index(kor.navn) if kor.navn in consts.bareKorNavnTKSRekkefølge else len(consts.bareKorNavnTKSRekkefølge)
+        kor.save(update_fields=['sortOrder', 'sortOrderTKS'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0024_loggm2m_loggm2m_pairing_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kor',
+            name='sortOrder',
+            field=models.SmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='kor',
+            name='sortOrderTKS',
+            field=models.SmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfillSortOrder, migrations.RunPython.noop),
+    ]
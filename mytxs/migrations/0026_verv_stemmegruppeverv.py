@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-08-29 05:31
+
+from django.db import migrations, models
+from django.db.models import Q
+
+from mytxs.utils.modelUtils import stemmegruppeVervRegex
+
+
+def backfillStemmegruppeVerv(apps, schema_editor):
+    'Fyll inn boolen for eksisterende verv, samme logikk som isStemmegruppeVervNavn'
+    Verv = apps.get_model('mytxs', 'Verv')
+    Verv.objects.filter(
+        Q(navn__regex=stemmegruppeVervRegex) | Q(navn='ukjentStemmegruppe')
+    ).update(stemmegruppeVerv=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0025_kor_sortorder_kor_sortordertks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='verv',
+            name='stemmegruppeVerv',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.RunPython(backfillStemmegruppeVerv, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-08-29 05:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0026_verv_stemmegruppeverv'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vervinnehavelse',
+            index=models.Index(fields=['verv', 'start', 'slutt'], name='vi_verv_start_slutt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vervinnehavelse',
+            index=models.Index(condition=models.Q(('slutt__isnull', True)), fields=['medlem', 'start'], name='vi_aktiv_partial_idx'),
+        ),
+    ]
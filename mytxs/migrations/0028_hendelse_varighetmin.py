@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-08-29 05:43
+
+from django.db import migrations, models
+from django.db.models import DurationField, ExpressionWrapper, F
+from django.db.models.functions import Cast, Extract
+
+
+def backfillVarighetMin(apps, schema_editor):
+    Hendelse = apps.get_model('mytxs', 'Hendelse')
+    Hendelse.objects.filter(sluttDatetime__isnull=False).update(varighetMin=Cast(Extract(ExpressionWrapper(
+        F('sluttDatetime') - F('startDatetime'), output_field=DurationField()
+    ), 'epoch') / 60, output_field=models.SmallIntegerField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0027_vervinnehavelse_vi_verv_start_slutt_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hendelse',
+            name='varighetMin',
+            field=models.SmallIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfillVarighetMin, migrations.RunPython.noop),
+    ]
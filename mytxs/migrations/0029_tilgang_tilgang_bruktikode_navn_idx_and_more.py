@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-08-29 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0028_hendelse_varighetmin'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tilgang',
+            index=models.Index(condition=models.Q(('bruktIKode', True)), fields=['navn'], name='tilgang_bruktikode_navn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='verv',
+            index=models.Index(condition=models.Q(('bruktIKode', True)), fields=['navn'], name='verv_bruktikode_navn_idx'),
+        ),
+    ]
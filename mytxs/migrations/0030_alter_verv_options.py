@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-08-29 05:52
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0029_tilgang_tilgang_bruktikode_navn_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='verv',
+            options={'ordering': ['kor', models.Case(models.When(navn__regex='^[12][12]?[SATB]$', then=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.text.StrIndex(models.Value('SATB'), django.db.models.functions.text.Right('navn', 1)), '-', models.Value(1)), '*', models.Value(6)), '+', django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(django.db.models.functions.text.Substr('navn', django.db.models.expressions.CombinedExpression(django.db.models.functions.text.Length('navn'), '-', models.Value(1)), 1), models.IntegerField()), '-', models.Value(1)), '*', models.Value(3))), '+', models.Case(models.When(navn__regex='^[12][12][SATB]$', then=django.db.models.functions.comparison.Cast(django.db.models.functions.text.Substr('navn', 1, 1), models.IntegerField())), default=0))), default=24, output_field=models.IntegerField()), 'navn'], 'verbose_name_plural': 'verv'},
+        ),
+    ]
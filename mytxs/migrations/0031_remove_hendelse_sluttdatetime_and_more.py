@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-08-29 06:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0030_alter_verv_options'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='hendelse',
+            name='sluttDatetime',
+        ),
+        migrations.RemoveField(
+            model_name='hendelse',
+            name='startDatetime',
+        ),
+    ]
@@ -1,14 +1,25 @@
 import datetime
+import hashlib
 import os
 import json
+import re
+from functools import lru_cache
+
+try:
+    # orjson (C extension) serialisere store logg-values mange ganger raskere enn stdlib json
+    import orjson
+except ImportError:
+    orjson = None
 
 from django import forms
 from django.apps import apps
 from django.conf import settings as djangoSettings
 from django.core import mail
+from django.contrib.postgres.indexes import GinIndex
+from django.core.cache import cache
 from django.db import models
-from django.db.models import Value as V, Q, Case, When, Max, Sum, ExpressionWrapper, F, OuterRef, Subquery, Prefetch, Exists
-from django.db.models.functions import Concat, ExtractMinute, ExtractHour, Right, Coalesce, Cast
+from django.db.models import Value as V, Q, Case, When, Count, Max, Sum, F, OuterRef, Subquery, Prefetch, Exists
+from django.db.models.functions import Concat, Right, Cast
 from django.forms import ValidationError
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -21,11 +32,23 @@ from mytxs.fields import BitmapMultipleChoiceField, MyDateField, MyManyToManyFie
 from mytxs.utils.formUtils import toolTip
 from mytxs.utils.googleCalendar import updateGoogleCalendar
 from mytxs.utils.modelCacheUtils import DbCacheModel, cacheQS, dbCache
-from mytxs.utils.modelUtils import annotateInstance, bareAktiveDecorator, qBool, groupBy, getInstancesForKor, isStemmegruppeVervNavn, korLookup, stemmegruppeOrdering, strToModels, validateBruktIKode, validateM2MFieldEmpty, validateStartSlutt, vervInnehavelseAktiv, stemmegruppeVerv
+from mytxs.utils.modelUtils import aktiveStemmegruppeMedlemmer, annotateInstance, bareAktiveDecorator, qBool, getOldSelf, groupBy, getInstancesForKor, inneværendeSemester, isStemmegruppeVervNavn, korLookup, stemmegruppeOrdering, strToModels, validateBruktIKode, validateM2MFieldEmpty, validateStartSlutt, vervInnehavelseAktiv, stemmegruppeVerv
 from mytxs.utils.navBar import navBarNode
 from mytxs.utils.utils import cropImage, getCord, getHalvårStart, getStemmegrupper
 
 
+@lru_cache(maxsize=None)
+def getForeignKeyFields(modelName):
+    'Skaffe foreign key fieldsa til en modell, cached sia _meta.get_fields() ikke e gratis og modellan ikke endre seg'
+    return [field for field in apps.get_model('mytxs', modelName)._meta.get_fields() if isinstance(field, models.ForeignKey)]
+
+
+@lru_cache(maxsize=None)
+def getReverseForeignKeyFields(modelName):
+    'Som getForeignKeyFields, men for foreign keys fra andre modeller som peke på denne modellen'
+    return [field.remote_field for field in apps.get_model('mytxs', modelName)._meta.get_fields() if isinstance(field, models.ManyToOneRel)]
+
+
 class LoggQuerySet(models.QuerySet):
     def getLoggForModelPK(self, model, pk):
         'Gets the most recent logg given a model (which may be a string or an actual model) and a pk'
@@ -89,45 +112,66 @@ class Logg(models.Model):
         satt inn der det e foreign keys til andre Logg objekt, slik at dette
         fint kan settes direkte inn i en <pre> tag.
         '''
-        jsonRepresentation = json.dumps(self.value, indent=4)
-
-        foreignKeyFields = list(filter(lambda field: isinstance(field, models.ForeignKey), self.getModel()._meta.get_fields()))
+        if orjson:
+            # orjson har bare 2-spaces indent, men getLineKey under bryr seg ikke om indenteringen
+            jsonRepresentation = orjson.dumps(self.value, option=orjson.OPT_INDENT_2).decode()
+        else:
+            jsonRepresentation = json.dumps(self.value, indent=4)
 
-        lines = jsonRepresentation.split('\n')
+        foreignKeyFields = getForeignKeyFields(self.model)
 
-        def getLineKey(line):
-            return line.split(':')[0].strip().replace('"', '')
+        # Skaff alle refererte logger i en query, istedenfor en query per foreign key
+        relatedLogger = Logg.objects.in_bulk(
+            [self.value[field.name] for field in foreignKeyFields if type(self.value.get(field.name)) == int]
+        )
 
-        for l in range(len(lines)):
-            for foreignKeyField in foreignKeyFields:
-                if foreignKeyField.name == getLineKey(lines[l]) and type(self.value[foreignKeyField.name]) == int:
-                    relatedLogg = Logg.objects.filter(pk=self.value[foreignKeyField.name]).first()
+        if relatedLogger:
+            # Erstatt alle foreign key pks med lenker i ett pass over strengen, istedenfor å
+            # loop over linjer gange foreign keys i python. JSONen e på forutsigbar '"key": pk' form.
+            pattern = re.compile(r'"(' + '|'.join(re.escape(field.name) for field in foreignKeyFields) + r')": (\d+)')
 
-                    lines[l] = lines[l].replace(f'{self.value[foreignKeyField.name]}', 
-                        f'<a href={relatedLogg.get_absolute_url()}>{relatedLogg.strRep}</a>')
+            def insertLink(match):
+                if relatedLogg := relatedLogger.get(int(match.group(2))):
+                    return f'"{match.group(1)}": <a href={relatedLogg.get_absolute_url()}>{relatedLogg.strRep}</a>'
+                return match.group(0)
 
-        jsonRepresentation = '\n'.join(lines)
+            jsonRepresentation = pattern.sub(insertLink, jsonRepresentation)
 
         return mark_safe(jsonRepresentation)
 
     def getReverseRelated(self):
         'Returne en liste av logger som referere (1:1 eller n:1) til denne loggen'
-        reverseForeignKeyRels = list(filter(lambda field: isinstance(field, models.ManyToOneRel), self.getModel()._meta.get_fields()))
-        foreignKeyFields = list(map(lambda rel: rel.remote_field, reverseForeignKeyRels))
-        
-        qs = Logg.objects.none()
+        foreignKeyFields = getReverseForeignKeyFields(self.model)
 
-        for foreignKeyField in foreignKeyFields:
-            qs |= Logg.objects.filter(
-                Q(**{f'value__{foreignKeyField.name}': self.pk}),
-                model=foreignKeyField.model.__name__,
-            )
+        # UNION istedenfor å OR-e filtrene sammen i en query — da får Postgres en enkel,
+        # indekserbar query per modell som databasen selv konkatenere, istedenfor en stor
+        # OR over alle modellene i samme scan.
+        # Containment (@>) istedenfor key-oppslag (->), så Postgres kan bruke GIN-indexen på value
+        querysets = [Logg.objects.filter(
+            value__contains={foreignKeyField.name: self.pk},
+            model=foreignKeyField.model.__name__,
+        ) for foreignKeyField in foreignKeyFields]
 
-        return qs
+        if not querysets:
+            return Logg.objects.none()
+
+        return querysets[0].union(*querysets[1:]).order_by('-timeStamp', '-pk')
     
     def getM2MRelated(self):
-        'Skaffe alle m2m logger for denne loggen'
-        return groupBy(self.forwardM2Ms.all() | self.backwardM2Ms.all(), 'm2mName')
+        'Skaffe alle m2m logger for denne loggen, med tilsvarende create/delete ferdig koblet på'
+        # select_related så rendring av LoggM2M-ene ikke treffe databasen per rad for from/toLogg
+        related = groupBy(LoggM2M.objects.filter(Q(fromLogg=self) | Q(toLogg=self))\
+            .select_related('fromLogg', 'toLogg').annotateCorresponding(), 'm2mName')
+
+        # Koble på de tilsvarende LoggM2M-ene med en bulk-query, istedenfor at templaten
+        # kaller correspondingM2M (en ordnet first()-query) flere ganger per rad
+        m2ms = [m2m for m2mListe in related.values() for m2m in m2mListe]
+        correspondingM2Ms = LoggM2M.objects.select_related('fromLogg', 'toLogg')\
+            .in_bulk([m2m.correspondingPK for m2m in m2ms if m2m.correspondingPK])
+        for m2m in m2ms:
+            m2m.corresponding = correspondingM2Ms.get(m2m.correspondingPK)
+
+        return related
 
     def getActual(self):
         'Get the object this Logg is a log of, if it exists'
@@ -140,17 +184,21 @@ class Logg(models.Model):
                 return actual.get_absolute_url()
 
     def nextLogg(self):
+        # pk e monotont stigende med timeStamp, så pk-grensen lar planleggeren bruke
+        # primærnøkkelen som billig range-avgrensning i tillegg til indexen
         return Logg.objects.filter(
             model=self.model,
             instancePK=self.instancePK,
-            timeStamp__gt=self.timeStamp
+            timeStamp__gt=self.timeStamp,
+            pk__gt=self.pk
         ).order_by('timeStamp').first()
     
     def lastLogg(self):
         return Logg.objects.filter(
             model=self.model,
             instancePK=self.instancePK,
-            timeStamp__lt=self.timeStamp
+            timeStamp__lt=self.timeStamp,
+            pk__lt=self.pk
         ).order_by('-timeStamp').first()
 
     def get_absolute_url(self):
@@ -162,9 +210,43 @@ class Logg(models.Model):
     class Meta:
         ordering = ['-timeStamp', '-pk']
         verbose_name_plural = 'logger'
+        indexes = [
+            # Både slettGamleOppmøter, getLoggForModelPK og nextLogg/lastLogg slår opp på
+            # (model, instancePK), de to siste også sortert på timeStamp
+            models.Index(fields=['model', 'instancePK', 'timeStamp'], name='logg_model_pk_ts_idx'),
+            # Dekke foreign key oppslagene i value som getReverseRelated gjør med containment
+            GinIndex(fields=['value'], name='logg_value_gin', opclasses=['jsonb_path_ops'])
+        ]
+
+
+class LoggM2MQuerySet(models.QuerySet):
+    def annotateCorresponding(self):
+        '''
+        Annotate pk-en til tilsvarende create/delete LoggM2M som correspondingPK, i samme query
+        istedenfor en query per rad som det gamle correspondingM2M. Subqueries istedenfor en
+        window-pass, sia den tilsvarende raden gjerne ikke e med i et filtrert queryset
+        (paret har egne Logg-rader, så getM2MRelated sitt filter ser den aldri).
+        '''
+        def correspondingSubquery(change, timeStampLookup, ordering):
+            return Subquery(LoggM2M.objects.filter(**{
+                'fromLogg__instancePK': OuterRef('fromLogg__instancePK'),
+                'toLogg__instancePK': OuterRef('toLogg__instancePK'),
+                'm2mName': OuterRef('m2mName'),
+                'change': change,
+                timeStampLookup: OuterRef('timeStamp')
+            }).order_by(ordering).values('pk')[:1])
+
+        return self.annotate(
+            correspondingPK=Case(
+                When(change=LoggM2M.CREATE, then=correspondingSubquery(LoggM2M.DELETE, 'timeStamp__gt', 'timeStamp')),
+                default=correspondingSubquery(LoggM2M.CREATE, 'timeStamp__lt', '-timeStamp')
+            )
+        )
 
 
 class LoggM2M(models.Model):
+    objects = LoggM2MQuerySet.as_manager()
+
     timeStamp = models.DateTimeField(auto_now_add=True)
 
     m2mName = models.CharField(
@@ -197,34 +279,15 @@ class LoggM2M(models.Model):
     CHANGE_CHOICES = ((CREATE, 'Create'), (DELETE, 'Delete'))
     change = models.SmallIntegerField(choices=CHANGE_CHOICES, null=False)
 
-    def correspondingM2M(self, forward=True):
-        'Gets the corresponding create or delete M2M'
-        if self.change == LoggM2M.CREATE:
-            return LoggM2M.objects.filter(
-                fromLogg__instancePK=self.fromLogg.instancePK,
-                toLogg__instancePK=self.toLogg.instancePK,
-                m2mName=self.m2mName,
-                change=LoggM2M.DELETE,
-                timeStamp__gt=self.timeStamp
-            ).order_by(
-                'timeStamp'
-            ).first()
-        else:
-            return LoggM2M.objects.filter(
-                fromLogg__instancePK=self.fromLogg.instancePK,
-                toLogg__instancePK=self.toLogg.instancePK,
-                m2mName=self.m2mName,
-                change=LoggM2M.CREATE,
-                timeStamp__lt=self.timeStamp
-            ).order_by(
-                '-timeStamp'
-            ).first()
-
     def __str__(self):
         return f'{self.m2mName}{"-_+"[self.change+1]} {self.fromLogg.strRep} <-> {self.toLogg.strRep}'
 
     class Meta:
         ordering = ['-timeStamp', '-pk']
+        indexes = [
+            # Dekke paringsoppslagene i annotateCorresponding
+            models.Index(fields=['fromLogg', 'toLogg', 'm2mName', 'change', 'timeStamp'], name='loggm2m_pairing_idx')
+        ]
 
 
 class MedlemQuerySet(models.QuerySet):
@@ -318,11 +381,11 @@ class MedlemQuerySet(models.QuerySet):
                 vervInnehavelseAktiv(''),
                 ~stemmegruppeVerv(includeDirr=True),
                 verv__kor__navn__in=[kor.navn, consts.Kor.Sangern] if kor.navn in consts.bareStorkorNavn else [kor.navn]
-            ).prefetch_related('verv__kor')),
+            ).select_related('verv__kor')),
             Prefetch('dekorasjonInnehavelser', queryset=DekorasjonInnehavelse.objects.none() if kor == None else DekorasjonInnehavelse.objects.filter(
                 ~Q(dekorasjon__overvalør__dekorasjonInnehavelser__medlem__pk=F('medlem__pk')),
                 dekorasjon__kor__navn__in=[kor.navn, consts.Kor.Sangern] if kor.navn in consts.bareStorkorNavn else [kor.navn]
-            ).prefetch_related('dekorasjon__kor')),
+            ).select_related('dekorasjon__kor')),
         )
 
     def annotatePermisjon(self, kor, dato=None):
@@ -337,26 +400,13 @@ class MedlemQuerySet(models.QuerySet):
 
     def annotateFravær(self, kor, heleSemesteret=False):
         'Annotater umeldtFravær, ugyldigFravær, gyldigFravær og hendelseVarighet'
-        def getDateTime(fieldName, backupDateFieldName=None):
-            'Kombinere og returne separate Date og Time felt til ett DateTime felt'
-            return ExpressionWrapper(
-                (Coalesce(f'{fieldName}Date', f'{backupDateFieldName}Date') if backupDateFieldName else F(f'{fieldName}Date')) + 
-                F(f'{fieldName}Time'),
-                output_field=models.DateTimeField()
-            )
-
-        hendelseVarighet = ExpressionWrapper(
-            ExtractMinute(getDateTime('oppmøter__hendelse__slutt', backupDateFieldName='oppmøter__hendelse__start') - getDateTime('oppmøter__hendelse__start')) + 
-            ExtractHour(getDateTime('oppmøter__hendelse__slutt', backupDateFieldName='oppmøter__hendelse__start') - getDateTime('oppmøter__hendelse__start')) * 60,
-            output_field=models.IntegerField()
-        )
-
-        today = datetime.date.today()
+        # Hendelse vedlikeholder en lagret varighetMin kolonne, så vi slipper å regne ut
+        # varigheten fra datetime-kolonnene per rad per aggregat her.
+        hendelseVarighet = F('oppmøter__hendelse__varighetMin')
 
         filterQ = Q(
-            Q(oppmøter__hendelse__startDate__month__gte=7) if today.month >= 7 else Q(oppmøter__hendelse__startDate__month__lt=7),
+            inneværendeSemester('oppmøter__hendelse__startDate'),
             korLookup(kor, 'oppmøter__hendelse__kor'),
-            oppmøter__hendelse__startDate__year=today.year,
             oppmøter__hendelse__kategori=Hendelse.OBLIG
         )
 
@@ -445,7 +495,12 @@ class Medlem(DbCacheModel):
 
     @cached_property
     def aktiveKor(self):
-        'Returne kor medlemmet er aktiv i, sortert med storkor først. Ignorerer permisjon.'
+        '''
+        Returne kor medlemmet er aktiv i, sortert med storkor først. Ignorerer permisjon.
+
+        Querysettet e cacheQS-a, så filter/exists/values_list på navn e gratis, men ikke bruk
+        det direkte som subquery (__in) — da kjøre Django heile queryen på nytt. Bruk list() da.
+        '''
         return cacheQS(Kor.objects.filter(
             stemmegruppeVerv(includeDirr=True),
             vervInnehavelseAktiv('verv__vervInnehavelser'),
@@ -489,7 +544,19 @@ class Medlem(DbCacheModel):
         if not self.innstillinger.get('tversAvKor', False):
             tilganger = tilganger.exclude(navn=consts.Tilgang.tversAvKor)
         return cacheQS(tilganger.select_related('kor'), props=['navn', 'kor', 'kor__navn'])
-    
+
+    @cached_property
+    def tilgangKorPks(self):
+        '''
+        Dict fra tilgangnavn til settet av kor-pks der vi har den tilgangen, utledet fra
+        tilganger-cachen uten nye queries. Brukes for å slippe subqueries via tilganger__in
+        i tilgangsoppslagene, som ellers hitter databasen per oppslag.
+        '''
+        tilgangKorPks = {}
+        for tilgang in self.tilganger:
+            tilgangKorPks.setdefault(tilgang.navn, set()).add(tilgang.kor_id)
+        return tilgangKorPks
+
     @cached_property
     def navBar(self):
         '''
@@ -501,9 +568,19 @@ class Medlem(DbCacheModel):
         subpages. Om det er ryddigere kan en løvnode settes til False. Den filtreres da bort før vi returne. 
         
         Veldig viktig at dette ikke returne noko som inneheld querysets, for da vil vi hitte databasen veldig mange ganger!
-        Dette e også en av få deler av kodebasen som faktisk kjører på alle sider, så fint å optimaliser denne koden 
-        så my som mulig mtp databaseoppslag. 
+        Dette e også en av få deler av kodebasen som faktisk kjører på alle sider, så fint å optimaliser denne koden
+        så my som mulig mtp databaseoppslag.
+
+        Resultatet caches kortlevd på tvers av requests. Innstillinger inngår i nøkkelen siden
+        adminTilganger/tversAvKor osv påvirker resultatet. Etter endring av verv/tilganger kan
+        navBar altså være opptil 60 sekunder utdatert, men det gjelder bare hvilke lenker som
+        vises — selve tilgangssjekkene gjøres uansett av harSideTilgang ved hver request.
         '''
+        cacheKey = f'navBar-{self.pk}-' + hashlib.md5(json.dumps(self.innstillinger, sort_keys=True).encode()).hexdigest()
+        return cache.get_or_set(cacheKey, self.genererNavBar, 60)
+
+    def genererNavBar(self):
+        'Bygge navBar hierarkiet, se navBar propertyen over for dokumentasjon'
         sider = navBarNode(inURL=False, isPage=False)
 
         # Sjekkheftet
@@ -523,12 +600,14 @@ class Medlem(DbCacheModel):
             sjekkheftet.addChildren(*småkor)
         sjekkheftet.addChildren(consts.Kor.Sangern, isPage=False)
 
-        # Sjekkheftet undergrupper
-        for sjekkhefteSide in Tilgang.objects.filter(
-            sjekkheftetSynlig=True, 
-            kor__navn__in=sjekkheftet.children.keys()
-        ).values('navn', 'kor__navn'):
-            navBarNode(sider['sjekkheftet', sjekkhefteSide['kor__navn']], sjekkhefteSide['navn'])
+        # Sjekkheftet undergrupper. Hvilke tilganger som vises her endres sjeldent og e like for
+        # alle medlemmer, så lista deles på tvers av requests og filtreres heller per medlem her.
+        sjekkhefteSider = cache.get_or_set('sjekkhefteSider', lambda: list(Tilgang.objects.filter(
+            sjekkheftetSynlig=True
+        ).values('navn', 'kor__navn')), 300)
+        for sjekkhefteSide in sjekkhefteSider:
+            if sjekkhefteSide['kor__navn'] in sjekkheftet.children:
+                navBarNode(sider['sjekkheftet', sjekkhefteSide['kor__navn']], sjekkhefteSide['navn'])
         sjekkheftet.addChildren('søk', 'kart', 'jubileum', 'sjekkhefTest', 'fellesEmner')
 
         # Semesterplan
@@ -555,7 +634,9 @@ class Medlem(DbCacheModel):
 
             fraværOversikt = navBarNode(fravær, 'oversikt', isPage=False)
             fraværStatistikk = navBarNode(fravær, 'statistikk', isPage=False)
-            if korMedFraværTilgang := Kor.objects.filter(tilganger__in=self.tilganger.filter(navn=consts.Tilgang.fravær)).values_list('navn', flat=True):
+            # tilganger-cachen har allerede kor__navn, så dette koster ingen query, i motsetning
+            # til det gamle oppslaget via Kor.objects.filter(tilganger__in=...)
+            if korMedFraværTilgang := self.tilganger.filter(navn=consts.Tilgang.fravær).values_list('kor__navn', flat=True):
                 fraværOversikt.addChildren(*korMedFraværTilgang)
                 fraværStatistikk.addChildren(*korMedFraværTilgang)
 
@@ -595,7 +676,7 @@ class Medlem(DbCacheModel):
         
         if kor := instance.kor:
             # Dersom den ikke finnes, men den vet hvilket kor den havner i
-            return Kor.objects.filter(tilganger__in=self.tilganger.filter(navn=consts.modelTilTilgangNavn[type(instance).__name__])).contains(kor)
+            return kor.pk in self.tilgangKorPks.get(consts.modelTilTilgangNavn[type(instance).__name__], set())
 
         # Ellers, return om vi har noen tilgang til den typen objekt
         return self.tilganger.filter(navn=consts.modelTilTilgangNavn[type(instance).__name__]).exists()
@@ -633,7 +714,7 @@ class Medlem(DbCacheModel):
         # Medlem er komplisert fordi medlem ikke har et enkelt forhold til kor. 
         if model == Medlem:
             # Skaff medlemmer i koret du har tilgangen
-            medlemmer = getInstancesForKor(resModel, Kor.objects.filter(tilganger__in=self.tilganger.filter(navn=consts.Tilgang.medlemsdata)))
+            medlemmer = getInstancesForKor(resModel, Kor.objects.filter(pk__in=self.tilgangKorPks.get(consts.Tilgang.medlemsdata, [])))
             
             # Dersom du har tversAvKor, hiv på alle medlemmer uten kor
             if resModel == Medlem and self.tilganger.filter(navn=consts.Tilgang.tversAvKor).exists():
@@ -644,7 +725,7 @@ class Medlem(DbCacheModel):
             return medlemmer
 
         # For alle andre modeller, bare skaff objektene for modellen og koret du evt har tilgangen. 
-        returnQueryset = getInstancesForKor(resModel, Kor.objects.filter(tilganger__in=self.tilganger.filter(navn=consts.modelTilTilgangNavn[model.__name__])))
+        returnQueryset = getInstancesForKor(resModel, Kor.objects.filter(pk__in=self.tilgangKorPks.get(consts.modelTilTilgangNavn[model.__name__], [])))
 
         # Exclude Verv og VervInnehavelser som gir tilganger som medlemmet ikke har, dersom medlemmet ikke har tilgang tilgangen 
         # i koret til vervet. Dette hindre at noen med vervInnehavelse tilgangen kan gjøre seg selv til Formann og gå løs på 
@@ -653,13 +734,13 @@ class Medlem(DbCacheModel):
         if model in [Verv, VervInnehavelse] and resModel in [Verv, VervInnehavelse]:
             if resModel == Verv:
                 return returnQueryset.exclude(
-                    ~Q(kor__tilganger__in=self.tilganger.filter(navn=consts.Tilgang.tilgang)),
-                    tilganger__in=Tilgang.objects.exclude(pk__in=self.tilganger).filter(bruktIKode=True),
+                    ~Q(kor__pk__in=self.tilgangKorPks.get(consts.Tilgang.tilgang, [])),
+                    tilganger__in=Tilgang.objects.exclude(pk__in=[tilgang.pk for tilgang in self.tilganger]).filter(bruktIKode=True),
                 )
             if resModel == VervInnehavelse:
                 return returnQueryset.exclude(
-                    ~Q(verv__kor__tilganger__in=self.tilganger.filter(navn=consts.Tilgang.tilgang)),
-                    verv__tilganger__in=Tilgang.objects.exclude(pk__in=self.tilganger).filter(bruktIKode=True), 
+                    ~Q(verv__kor__pk__in=self.tilgangKorPks.get(consts.Tilgang.tilgang, [])),
+                    verv__tilganger__in=Tilgang.objects.exclude(pk__in=[tilgang.pk for tilgang in self.tilganger]).filter(bruktIKode=True),
                 )
 
         return returnQueryset
@@ -705,9 +786,9 @@ class Medlem(DbCacheModel):
             if (
                 (model.__name__ == sourceModel) and \
                 (relatedTilgang := [consts.modelTilTilgangNavn[m] for m in relatedModel]) and \
-                (relaterteTilganger := self.tilganger.filter(navn__in=relatedTilgang))
+                (relaterteKorPks := set().union(*[self.tilgangKorPks.get(navn, set()) for navn in relatedTilgang]))
             ):
-                return getInstancesForKor(model, Kor.objects.filter(tilganger__in=relaterteTilganger)) | self.redigerTilgangQueryset(model)
+                return getInstancesForKor(model, Kor.objects.filter(pk__in=relaterteKorPks)) | self.redigerTilgangQueryset(model)
 
         # Forøverig, return de sidene der du kan redigere sidens instans
         return self.redigerTilgangQueryset(model)
@@ -724,8 +805,8 @@ class Medlem(DbCacheModel):
     def __str__(self):
         if self.pk:
             # Det som allerede e annotata kan vær feil no, så gjør det på nytt!
-            annotateInstance(self, MedlemQuerySet.annotateKor)
-            annotateInstance(self, MedlemQuerySet.annotateKarantenekor, storkor=True)
+            # Begge annotations i samme annotateInstance, så dette bli en query istedenfor to
+            annotateInstance(self, lambda qs: qs.annotateKor().annotateKarantenekor(storkor=True))
             if self.korNavn:
                 return f'{self.navn} {self.korNavn} ' + 'K' + (str(self.karantenekor)[-2:] if self.karantenekor >= 2000 else str(self.karantenekor))
         return self.navn
@@ -743,13 +824,24 @@ class Medlem(DbCacheModel):
                     code='ugyldigEmnekode'
                 )
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Husk bildenavnet fra innlastingen, så save() slipper en ekstra SELECT for å oppdage endring
+        instance._lastetBilde = instance.__dict__.get('bilde')
+        return instance
+
     def save(self, *args, **kwargs):
-        self.clean()
+        self.cleanOmNødvendig()
 
-        # Crop bildet om det har endret seg
-        if self.pk and self.bilde and self.bilde != Medlem.objects.get(pk=self.pk).bilde:
+        updateFields = kwargs.get('update_fields')
+
+        # Crop bildet om det har endret seg siden innlastingen
+        if self.pk and self.bilde and (updateFields == None or 'bilde' in updateFields) and \
+            self.bilde.name != getattr(self, '_lastetBilde', None):
             self.bilde = cropImage(self.bilde, self.bilde.name, 270, 330)
         super().save(*args, **kwargs)
+        self._lastetBilde = self.bilde.name if self.bilde else None
 
     def delete(self, *args, **kwargs):
         validateM2MFieldEmpty(self, 'turneer')
@@ -759,11 +851,7 @@ class Medlem(DbCacheModel):
 class KorQuerySet(models.QuerySet):
     def orderKor(self, tksRekkefølge=False):
         'Sorter kor på storkor først og deretter på kjønnsfordeling'
-        return self.order_by(Case(
-            *[When(navn=kor, then=i) for i, kor in 
-                (enumerate(consts.bareKorNavn if not tksRekkefølge else consts.bareKorNavnTKSRekkefølge))
-            ]
-        ))
+        return self.order_by('sortOrderTKS' if tksRekkefølge else 'sortOrder')
 
 
 class Kor(models.Model):
@@ -773,6 +861,18 @@ class Kor(models.Model):
     tittel = models.CharField(max_length=50)
     stemmefordeling = models.CharField(choices=[(sf, sf) for sf in ['SA', 'TB', 'SATB', '']], default='', blank=True)
 
+    sortOrder = models.SmallIntegerField(editable=False, default=0)
+    'Plassering i standard korrekkefølge, settes automatisk i save()'
+
+    sortOrderTKS = models.SmallIntegerField(editable=False, default=0)
+    'Plassering i TKS-rekkefølgen, settes automatisk i save()'
+
+    def save(self, *args, **kwargs):
+        # Materialiser sorteringsrekkefølgene, så orderKor slipper å generere en CASE over alle koran per query
+        self.sortOrder = consts.bareKorNavn.index(self.navn) if self.navn in consts.bareKorNavn else len(consts.bareKorNavn)
+        self.sortOrderTKS = consts.bareKorNavnTKSRekkefølge.index(self.navn) if self.navn in consts.bareKorNavnTKSRekkefølge else len(consts.bareKorNavnTKSRekkefølge)
+        super().save(*args, **kwargs)
+
     def stemmegrupper(self, lengde=2, ekstraDybde=0):
         'Skaffe stemmegruppan til koret (strings) opp til ønsket lengde'
         if self.navn not in consts.bareKorNavn:
@@ -803,9 +903,8 @@ class Verv(DbCacheModel):
         verbose_name='Brukt i kode'
     )
 
-    @cached_property
-    def stemmegruppeVerv(self):
-        return isStemmegruppeVervNavn(self.navn)
+    stemmegruppeVerv = models.BooleanField(default=False, editable=False, db_index=True)
+    'Om vervet e et stemmegruppeverv (inkludert ukjentStemmegruppe), settes automatisk i save()'
 
     def get_absolute_url(self):
         return reverse('verv', args=[self.kor.navn, self.navn])
@@ -818,10 +917,20 @@ class Verv(DbCacheModel):
         unique_together = ('navn', 'kor')
         ordering = ['kor', stemmegruppeOrdering(), 'navn']
         verbose_name_plural = 'verv'
+        indexes = [
+            # Gjør navneproben i validateBruktIKode til et oppslag i en liten partiell index
+            models.Index(fields=['navn'], condition=Q(bruktIKode=True), name='verv_bruktikode_navn_idx')
+        ]
 
     def clean(self, *args, **kwargs):
         validateBruktIKode(self)
-    
+
+    def save(self, *args, **kwargs):
+        # Materialiser om dette e et stemmegruppeverv, så queries kan filtrere på en indeksert
+        # boolean istedenfor regex på navn. Se stemmegruppeVerv i modelUtils.
+        self.stemmegruppeVerv = bool(isStemmegruppeVervNavn(self.navn))
+        super().save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
         validateM2MFieldEmpty(self, 'tilganger')
         super().delete(*args, **kwargs)
@@ -859,41 +968,39 @@ class VervInnehavelse(DbCacheModel):
         unique_together = ('medlem', 'verv', 'start')
         ordering = ['-start', '-slutt', '-pk']
         verbose_name_plural = 'vervinnehavelser'
+        indexes = [
+            # Dekke overlappsjekken i clean og oppmøteMedlemmer/annotatePermisjon-oppslagan.
+            # (medlem, verv, start) dekkes allerede av unique_together.
+            models.Index(fields=['verv', 'start', 'slutt'], name='vi_verv_start_slutt_idx'),
+            # Aktive vervInnehavelser uten sluttdato e det vanligste oppslaget
+            models.Index(fields=['medlem', 'start'], condition=Q(slutt__isnull=True), name='vi_aktiv_partial_idx')
+        ]
 
     def clean(self, *args, **kwargs):
         validateStartSlutt(self)
         # Valider at dette medlemmet ikke har dette vervet i samme periode med en annen vervInnehavelse.
+        # Stemmegruppeverv kolliderer med alle stemmegruppeverv i samme kor, andre verv bare med seg selv.
+        # Datooverlappen e lik for begge, så vi bygge en felles query og tar en exists()-rundtur istedenfor to grener.
         if hasattr(self, 'verv') and hasattr(self, 'medlem'):
-            if self.verv.stemmegruppeVerv:
-                if VervInnehavelse.objects.filter(
-                    ~Q(pk=self.pk),
-                    stemmegruppeVerv(),
-                    ~(Q(slutt__isnull=False) & Q(slutt__lt=self.start)),
-                    ~qBool(self.slutt, trueOption=Q(start__gt=self.slutt)),
-                    verv__kor=self.kor,
-                    medlem=self.medlem,
-                ).exists():
-                    raise ValidationError(
-                        _('Kan ikke ha flere stemmegruppeverv i samme kor samtidig'),
-                        code='overlappingVervInnehavelse'
-                    )
-            else:
-                if VervInnehavelse.objects.filter(
-                    ~Q(pk=self.pk),
-                    ~(Q(slutt__isnull=False) & Q(slutt__lt=self.start)),
-                    ~qBool(self.slutt, trueOption=Q(start__gt=self.slutt)),
-                    medlem=self.medlem,
-                    verv=self.verv,
-                ).exists():
-                    raise ValidationError(
-                        _('Kan ikke ha flere vervInnehavelser av samme verv samtidig'),
-                        code='overlappingVervInnehavelse'
-                    )
+            erStemmegruppeVerv = self.verv.stemmegruppeVerv
+            if VervInnehavelse.objects.filter(
+                ~Q(pk=self.pk),
+                Q(stemmegruppeVerv(), verv__kor=self.kor) if erStemmegruppeVerv else Q(verv=self.verv),
+                ~(Q(slutt__isnull=False) & Q(slutt__lt=self.start)),
+                ~qBool(self.slutt, trueOption=Q(start__gt=self.slutt)),
+                medlem=self.medlem,
+            ).exists():
+                raise ValidationError(
+                    _('Kan ikke ha flere stemmegruppeverv i samme kor samtidig') if erStemmegruppeVerv else
+                    _('Kan ikke ha flere vervInnehavelser av samme verv samtidig'),
+                    code='overlappingVervInnehavelse'
+                )
 
     def save(self, *args, **kwargs):
-        self.clean()
+        self.cleanOmNødvendig()
 
-        oldSelf = VervInnehavelse.objects.filter(pk=self.pk).first()
+        # select_related så oldSelf.verv.stemmegruppeVerv/navn oppslagan under ikke gir ekstra queries
+        oldSelf = VervInnehavelse.objects.select_related('verv__kor').filter(pk=self.pk).first()
 
         super().save(*args, **kwargs)
 
@@ -905,16 +1012,20 @@ class VervInnehavelse(DbCacheModel):
         # - "Medlemmer som har aktive stemmegruppeverv som ikke har permisjon den dagen."
         # - "Hendelsene som faller på dager der vi har endret et permisjon/stemmegruppeverv, 
         # eller dager vi ikke har endret dersom vi endrer typen verv."
-        if self.verv.stemmegruppeVerv or self.verv.navn == 'Permisjon' or \
-            (oldSelf and (oldSelf.verv.stemmegruppeVerv or oldSelf.verv.navn == 'Permisjon')):
+        # Slå opp verv-egenskapan en gang istedenfor i hver grening under
+        erStemmegruppeVerv = self.verv.stemmegruppeVerv
+        erPermisjon = self.verv.navn == 'Permisjon'
+        varStemmegruppeVerv = bool(oldSelf) and oldSelf.verv.stemmegruppeVerv
+        varPermisjon = bool(oldSelf) and oldSelf.verv.navn == 'Permisjon'
+
+        if erStemmegruppeVerv or erPermisjon or varStemmegruppeVerv or varPermisjon:
 
             hendelser = Hendelse.objects.filter(kor=self.verv.kor)
-            
+
             if not oldSelf:
                 # Om ny vervInnehavelse, save på alle hendelser i varigheten
                 hendelser.genererHendelseOppmøter(self.start, self.slutt)
-            elif self.verv.stemmegruppeVerv != oldSelf.verv.stemmegruppeVerv or \
-                (self.verv.navn == 'Permisjon') != (oldSelf.verv.navn == 'Permisjon'):
+            elif erStemmegruppeVerv != varStemmegruppeVerv or erPermisjon != varPermisjon:
                 # Om vi bytte hvilken type verv det er, save alle hendelser i hele perioden
                 hendelser.genererHendelseOppmøter(self.start, self.slutt, oldSelf.start, oldSelf.slutt)
             else:
@@ -980,6 +1091,9 @@ class Tilgang(DbCacheModel):
         unique_together = ('kor', 'navn')
         ordering = ['kor', 'navn']
         verbose_name_plural = 'tilganger'
+        indexes = [
+            models.Index(fields=['navn'], condition=Q(bruktIKode=True), name='tilgang_bruktikode_navn_idx')
+        ]
 
     def clean(self, *args, **kwargs):
         validateBruktIKode(self)
@@ -1063,7 +1177,7 @@ class Dekorasjon(DbCacheModel):
 
 
     def save(self, *args, **kwargs):
-        self.clean()
+        self.cleanOmNødvendig()
         if self.pk and self.ikon and self.ikon != Dekorasjon.objects.get(pk=self.pk).ikon:
             self.ikon = cropImage(self.ikon, self.ikon.name, 40, 40)
         super().save(*args, **kwargs)
@@ -1125,7 +1239,7 @@ class DekorasjonInnehavelse(DbCacheModel):
                 )
 
     def save(self, *args, **kwargs):
-        self.clean()
+        self.cleanOmNødvendig()
         super().save(*args, **kwargs)
 
 
@@ -1167,7 +1281,7 @@ class Turne(DbCacheModel):
         validateStartSlutt(self)
 
     def save(self, *args, **kwargs):
-        self.clean()
+        self.cleanOmNødvendig()
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
@@ -1178,11 +1292,44 @@ class Turne(DbCacheModel):
 class HendelseQuerySet(models.QuerySet):
     def genererHendelseOppmøter(self, *dates):
         'Call genererOppmøter på hendelser mellom minste og støste Date i dates. None skal tolkes som date.max'
-        for hendelse in self.filter(
-            qBool(True) if None in dates else Q(startDate__lte=max(dates)), 
-            startDate__gte=min([d for d in dates if d != None]), 
-        ):
-            hendelse.genererOppmøter()
+        hendelser = list(self.filter(
+            qBool(True) if None in dates else Q(startDate__lte=max(dates)),
+            # genererOppmøter rører uansett ikke tidligere semestre, så ikke last de inn i det hele tatt
+            startDate__gte=max(min([d for d in dates if d != None]), getHalvårStart()),
+        ).select_related('kor').order_by())  # Rekkefølgen e likegyldig, så dropp sorten fra Meta.ordering
+
+        # Hent stemmegruppeverv og permisjoner for hele perioden i to queries per kor, og finn
+        # heller hvilke som e aktive på hver hendelsesdato i python. Ellers hadde oppmøteMedlemmer
+        # kjørt sin tunge query (med permisjons-subquery) en gang per hendelse.
+        def aktivePKs(rader, dato):
+            return {medlemPK for medlemPK, start, slutt in rader if start <= dato and (slutt == None or slutt >= dato)}
+
+        medlemPKsPerHendelse = {}
+        oppmøteHendelser = [h for h in hendelser if h.kategori not in [Hendelse.FRIVILLIG, Hendelse.UNDERGRUPPE]]
+        for korId in {hendelse.kor_id for hendelse in oppmøteHendelser}:
+            korHendelser = [hendelse for hendelse in oppmøteHendelser if hendelse.kor_id == korId]
+            periodeQ = Q(
+                Q(slutt__isnull=True) | Q(slutt__gte=min(hendelse.startDate for hendelse in korHendelser)),
+                start__lte=max(hendelse.startDate for hendelse in korHendelser)
+            )
+
+            stemmegruppeRader = list(VervInnehavelse.objects.filter(
+                periodeQ, stemmegruppeVerv(includeDirr=True), korLookup(korHendelser[0].kor, 'verv__kor')
+            ).order_by().values_list('medlem_id', 'start', 'slutt'))
+
+            permisjonRader = list(VervInnehavelse.objects.filter(
+                periodeQ, korLookup(korHendelser[0].kor, 'verv__kor'), verv__navn='Permisjon'
+            ).order_by().values_list('medlem_id', 'start', 'slutt'))
+
+            for hendelse in korHendelser:
+                medlemPKsPerHendelse[hendelse.pk] = list(
+                    aktivePKs(stemmegruppeRader, hendelse.startDate) - aktivePKs(permisjonRader, hendelse.startDate)
+                )
+
+        for hendelse in hendelser:
+            # Hendelsen e nettopp lest uendret fra databasen, så den duge som sitt eget oldSelf.
+            # Sparer en oldSelf-query og en unødvendig fiksOppmøteAnkomst-runde per hendelse.
+            hendelse.genererOppmøter(oldSelf=hendelse, medlemPKs=medlemPKsPerHendelse.get(hendelse.pk))
 
     def annotateDirigentTilstede(self):
         return self.annotate(
@@ -1253,6 +1400,9 @@ class Hendelse(DbCacheModel):
     sluttDate = MyDateField(blank=True, null=True, verbose_name='Slutt dato')
     sluttTime = MyTimeField(blank=True, null=True, verbose_name='Slutt tid')
 
+    varighetMin = models.SmallIntegerField(null=True, editable=False)
+    'Varigheten i minutter som lagret kolonne, vedlikeholdt i save() så aggregeringer slipper å regne den ut per rad'
+
     @property
     def start(self):
         'Start av hendelsen som datetime eller date'
@@ -1279,8 +1429,7 @@ class Hendelse(DbCacheModel):
     def kalenderMedlemmer(self):
         'Omvendte av Medlem.getHendelser, returne queryset av medlemmer som skal få opp dette i kalendern sin.'
         return Medlem.objects.filter(# Dem som e aktiv no
-            vervInnehavelseAktiv(),
-            stemmegruppeVerv('vervInnehavelser__verv', includeDirr=True),
+            aktiveStemmegruppeMedlemmer(includeDirr=True),
             vervInnehavelser__verv__kor__navn__in=consts.bareStorkorNavn if self.kor.navn == consts.Kor.Sangern else [self.kor.navn]
         ).filter(# Og som begynt før hendelsen her (og undergruppe da)
             Q(oppmøter__hendelse=self) if self.kategori == Hendelse.UNDERGRUPPE else qBool(True),
@@ -1303,15 +1452,28 @@ class Hendelse(DbCacheModel):
             permisjon=False
         ).distinct() # distinct fordi dirigenten også kan syng i koret
 
-    def addOppmøter(self, medlemmer):
-        'Legg til oppmøtan til disse medlemman'
-        for medlem in medlemmer.filter(~Q(oppmøter__hendelse=self)):
-            self.oppmøter.create(medlem=medlem, hendelse=self, ankomst=self.defaultAnkomst)
-
-    def removeOppmøter(self, medlemmer, oldSelf=None, softDelete=True):
-        'Fjerne oppmøter til medlemman som ikkje e i medlemmer lista.'
+    def addOppmøter(self, medlemPKs):
+        'Legg til oppmøtan til disse medlemman, gitt som en liste av medlem pks'
+        # Siden bulk_create går utenom DbCacheModel.save må vi fyll dbCacheField sjølv, ellers
+        # vise oppmøtan UNSAVED_OBJ_STR i admin og i slette-loggan. Vi sett sammen strengen slik
+        # Oppmøte.__str__ gjør det, med medlemman sine allerede cacha strenger fra én query.
+        prefiks = {Hendelse.OBLIG: 'Fraværssøknad', Hendelse.PÅMELDING: 'Påmelding'}.get(self.kategori, 'Oppmøte')
+        medlemStrs = {pk: dbCacheField.get('__str__') for pk, dbCacheField in
+                      Medlem.objects.filter(pk__in=medlemPKs).values_list('pk', 'dbCacheField')}
+
+        # En INSERT ... ON CONFLICT DO NOTHING (ignore_conflicts) mot unique (medlem, hendelse)
+        # lar databasen hoppe over de som allerede har oppmøte, så vi verken treng å slå opp
+        # eksisterende rader først eller bekymre oss for racing genereringer.
+        Oppmøte.objects.bulk_create([
+            Oppmøte(medlem_id=medlemPK, hendelse=self, ankomst=self.defaultAnkomst,
+                    dbCacheField={'__str__': f'{prefiks} {medlemStrs[medlemPK]} -> {self}'})
+            for medlemPK in medlemPKs
+        ], ignore_conflicts=True)
+
+    def removeOppmøter(self, medlemPKs, oldSelf=None, softDelete=True):
+        'Fjerne oppmøter til medlemman som ikkje e blant disse medlem pksa.'
         self.oppmøter.filter(
-            ~Q(medlem__in=medlemmer),
+            ~Q(medlem_id__in=medlemPKs),
             qBool(True) if not softDelete else Q(
                 fravær__isnull=True,
                 ankomst=oldSelf.defaultAnkomst,
@@ -1322,15 +1484,15 @@ class Hendelse(DbCacheModel):
     def fiksOppmøteAnkomst(self, oldSelf):
         'Sett oppmøtan sin ankomst til den nye default ankomsten, dersom de ikke har en melding.'
         if self.defaultAnkomst != oldSelf.defaultAnkomst:
-            for oppmøte in self.oppmøter.filter(melding=''):
-                oppmøte.ankomst = self.defaultAnkomst
-                oppmøte.save()
+            # En UPDATE istedenfor en save() (med clean og oldSelf-oppslag) per oppmøte
+            self.oppmøter.filter(melding='').update(ankomst=self.defaultAnkomst)
 
-    def genererOppmøter(self, undergruppeMedlemmer=None, oldSelf=None, softDelete=True):
+    def genererOppmøter(self, undergruppeMedlemmer=None, oldSelf=None, softDelete=True, medlemPKs=None):
         '''
-        Legg til og fjerner så hendelsen har oppmøtene den skal ha. 
-        Sletter ikke oppmøter som har informasjon assosiert med seg, om ikke softDelete er False. 
-        Calles fra addHendelseMedlemmer formet med undergruppeMedlemmer, når det e en undergruppe hendelse. 
+        Legg til og fjerner så hendelsen har oppmøtene den skal ha.
+        Sletter ikke oppmøter som har informasjon assosiert med seg, om ikke softDelete er False.
+        Calles fra addHendelseMedlemmer formet med undergruppeMedlemmer, når det e en undergruppe hendelse.
+        medlemPKs kan gis ferdig utregnet (se genererHendelseOppmøter) for å slippe oppmøteMedlemmer-querien.
         '''
         if self.startDate < getHalvårStart():
             # Ikkje legg til eller slett oppmøter fra tidligere semestre
@@ -1340,8 +1502,12 @@ class Hendelse(DbCacheModel):
             oldSelf = Hendelse.objects.filter(pk=self.pk).first()
 
         if self.kategori != Hendelse.UNDERGRUPPE:
-            self.addOppmøter(self.oppmøteMedlemmer)
-            self.removeOppmøter(self.oppmøteMedlemmer, oldSelf=oldSelf, softDelete=softDelete)
+            if medlemPKs == None:
+                # Materialiser medlemman en gang, så den dyre oppmøteMedlemmer-querien (med
+                # permisjons-annotering) ikke kjøre separat i både add og remove
+                medlemPKs = list(self.oppmøteMedlemmer.values_list('pk', flat=True))
+            self.addOppmøter(medlemPKs)
+            self.removeOppmøter(medlemPKs, oldSelf=oldSelf, softDelete=softDelete)
         else:
             medlemmer = Medlem.objects.none()
             if self.prefiksArray:
@@ -1354,9 +1520,10 @@ class Hendelse(DbCacheModel):
             if undergruppeMedlemmer:
                 medlemmer |= undergruppeMedlemmer
 
-            self.addOppmøter(medlemmer)
+            medlemPKs = list(medlemmer.values_list('pk', flat=True))
+            self.addOppmøter(medlemPKs)
             if undergruppeMedlemmer:
-                self.removeOppmøter(medlemmer, oldSelf=oldSelf, softDelete=softDelete)
+                self.removeOppmøter(medlemPKs, oldSelf=oldSelf, softDelete=softDelete)
 
         if oldSelf:
             self.fiksOppmøteAnkomst(oldSelf)
@@ -1366,15 +1533,21 @@ class Hendelse(DbCacheModel):
         Returne dict med stemmefordelingen på en hendelse, der key er stemmegruppen (len=2), 
         og valuen med en liste av antall som KOMMER, KOMMER_KANSKJE og KOMMER_IKKE i den stemmegruppen. 
         '''
-        stemmefordeling = {key: [0, 0, 0] for key in self.kor.stemmegrupper()}
+        def beregnStemmeFordeling():
+            stemmefordeling = {key: [0, 0, 0] for key in self.kor.stemmegrupper()}
 
-        for oppmøte in MedlemQuerySet.annotateStemmegruppe(self.oppmøter, kor=self.kor, pkPath='medlem__pk'):
-            if not oppmøte.stemmegruppe:
-                # Skip dirigenten
-                continue
-            stemmefordeling[oppmøte.stemmegruppe][[Oppmøte.KOMMER, Oppmøte.KOMMER_KANSKJE, Oppmøte.KOMMER_IKKE].index(oppmøte.ankomst)] += 1
-            
-        return stemmefordeling
+            # GROUP BY i databasen istedenfor å hente og telle hvert oppmøte i python, vi treng bare antallan
+            for rad in MedlemQuerySet.annotateStemmegruppe(self.oppmøter, kor=self.kor, pkPath='medlem__pk')\
+                .values('stemmegruppe', 'ankomst').annotate(antall=Count('pk')).order_by():
+                if not rad['stemmegruppe']:
+                    # Skip dirigenten
+                    continue
+                stemmefordeling[rad['stemmegruppe']][[Oppmøte.KOMMER, Oppmøte.KOMMER_KANSKJE, Oppmøte.KOMMER_IKKE].index(rad['ankomst'])] += rad['antall']
+
+            return stemmefordeling
+
+        # Både hendelse-malen og cron spør flere ganger, så cache med kort TTL (som navBar) fremfor invalidering
+        return cache.get_or_set(f'stemmeFordeling-{self.pk}', beregnStemmeFordeling, 60)
     
     @property
     def defaultAnkomst(self):
@@ -1393,6 +1566,10 @@ class Hendelse(DbCacheModel):
         unique_together = ('kor', 'navn', 'startDate')
         ordering = ['startDate', 'startTime', 'navn', 'kor']
         verbose_name_plural = 'hendelser'
+        indexes = [
+            # Dekke filtreringen i annotateFravær og semesterplan-oppslagene
+            models.Index(fields=['kor', 'kategori', 'startDate'], name='hendelse_kor_kat_start_idx')
+        ]
 
     def clean(self, *args, **kwargs):
         # Sjekk at navn har opptil et sett matchende '[' og ']' på begynnelsen
@@ -1430,21 +1607,27 @@ class Hendelse(DbCacheModel):
         if not self.pk:
             return
         
-        if self.oppmøter.filter(fravær__isnull=False).exists() and self.varighet == None:
+        # Max e None akkurat når ingen oppmøter har ført fravær, så begge sjekkan klare seg med et aggregat
+        maksFravær = self.oppmøter.aggregate(Max('fravær'))['fravær__max']
+
+        if maksFravær != None and self.varighet == None:
             raise ValidationError(
                 _(f'Kan ikke ha fravær på en hendelse uten varighet'),
                 code='fraværUtenVarighet'
             )
 
         # Sjekk at hendelsen vare lenger enn det største fraværet
-        if (self.varighet or 0) < (self.oppmøter.filter(fravær__isnull=False).aggregate(Max('fravær')).get('fravær__max') or 0):
+        if (self.varighet or 0) < (maksFravær or 0):
             raise ValidationError(
                 _(f'Å lagre dette vil føre til at noen får mere fravær enn varigheten av hendelsen.'),
                 code='merFraværEnnHendelse'
             )
     
     def save(self, *args, **kwargs):
-        self.clean()
+        self.cleanOmNødvendig()
+
+        # Vedlikehold den lagrede varighetkolonna
+        self.varighetMin = self.varighet
 
         oldSelf = Hendelse.objects.filter(pk=self.pk).first()
 
@@ -1556,9 +1739,9 @@ class Oppmøte(DbCacheModel):
             )
 
     def save(self, *args, **kwargs):
-        self.clean()
+        self.cleanOmNødvendig()
 
-        oldSelf = Oppmøte.objects.filter(pk=self.pk).first()
+        oldSelf = getOldSelf(self)
 
         if oldSelf:
             # Dersom melding har endret seg, og gyldig er UGYLDIG, endre gyldig til IKKE_BEHANDLET.
@@ -65,6 +65,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'mytxs.middleware.TodayMiddleware',
     'mytxs.middleware.ThreadingMiddleware',
     'mytxs.middleware.OptionFormMiddleware'
 ]
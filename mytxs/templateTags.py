@@ -116,7 +116,8 @@ def toggleURLparam(context, urlParamName, linkName=None, **kwargs):
 @register.filter
 def filterMedlemFirst(queryset, medlem):
     'For når man treng å filtrer et queryset på medlem=medlem, også si .first()'
-    return queryset.filter(medlem=medlem).first()
+    # Filtrer i python så en eventuell prefetch gjenbrukes istedenfor en ny query per rad
+    return next((obj for obj in queryset.all() if obj.medlem_id == medlem.pk), None)
 
 
 @register.filter
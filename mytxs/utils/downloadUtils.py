@@ -113,23 +113,27 @@ RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU
 END:STANDARD
 END:VTIMEZONE
 '''
-    for hendelse in medlem.getHendelser(korNavn):
+    iCalLines = []
+
+    def addLine(line):
+        'Split lines som e lenger enn 75 characters over fleir linja, fortløpende istedenfor å reparse hele kalenderen etterpå'
+        while len(line) > 75:
+            iCalLines.append(line[:75])
+            line = ' ' + line[75:]
+        iCalLines.append(line)
+
+    for line in iCalString.splitlines():
+        addLine(line)
+
+    # select_related kor sia getVeventFromHendelse bruke hendelse.kor i UID-en og navnMedPrefiks
+    for hendelse in medlem.getHendelser(korNavn).select_related('kor'):
         for key, value in getVeventFromHendelse(hendelse, medlem).items():
             if value:
-                iCalString += key + ':' + value + '\n'
-
-    iCalString += 'END:VCALENDAR\n'
+                addLine(key + ':' + value)
 
-    # Split lines som e lenger enn 75 characters over fleir linja
-    iCalLines = iCalString.split('\n')
-    l = 0
-    while l < len(iCalLines):
-        if len(iCalLines[l]) > 75:
-            iCalLines.insert(l+1, ' ' + iCalLines[l][75:])
-            iCalLines[l] = iCalLines[l][:75]
-        l += 1
+    addLine('END:VCALENDAR')
 
     # Join alle lines med CRLF
-    iCalString = '\r\n'.join(iCalLines)
+    iCalString = '\r\n'.join(iCalLines) + '\r\n'
 
     return downloadFile(f'{korNavn} semesterplan (iCal).ics', iCalString, content_type='text/calendar')
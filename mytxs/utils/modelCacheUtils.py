@@ -13,6 +13,16 @@ class DbCacheModel(models.Model):
 
     dbCacheField = models.JSONField(editable=False, default=dict)
 
+    def full_clean(self, *args, **kwargs):
+        super().full_clean(*args, **kwargs)
+        # Husk at vi nettopp validerte, så save() slipper å kjøre clean() (med queryan dens) en gang til
+        self._nyligValidert = True
+
+    def cleanOmNødvendig(self):
+        'Kjør clean() med mindre full_clean nettopp gjorde det, som ved lagring via forms.'
+        if not self.__dict__.pop('_nyligValidert', False):
+            self.clean()
+
     def saveRelated(self, oldSelf=None, caller=None, delete=False):
         'Lagre relaterte objekt basert på dbCache sin path.'
         for relation, reverseRelation, model in getAllRelatedModelsWithFieldNameAndReverse(type(self)):
@@ -170,14 +180,14 @@ def cacheQS(qs, props=['navn']):
             return cacheQS(result, props=props)
         return _decorator
 
+    def getByLookup(o, *keys):
+        return getByLookup(getattr(o, keys[0]), *keys[1:]) if keys else o
+
     def filterFunction(*args, **kwargs):
         if not all(map(lambda k: (k.removesuffix('__in') in props), kwargs.keys())):
             return False
         resultCache = qs._result_cache
 
-        def getByLookup(o, *keys):
-            return getByLookup(getattr(o, keys[0]), *keys[1:]) if keys else o
-
         for key, value in kwargs.items():
             if key.endswith('__in'):
                 resultCache = list(filter(lambda r: getByLookup(r, *key[:-4].split('__')) in value, resultCache))
@@ -188,7 +198,8 @@ def cacheQS(qs, props=['navn']):
     def flatValuesListFunction(*args, **kwargs):
         if kwargs.get('flat') == False or args[0] not in props:
             return False
-        return list(map(lambda r: getattr(r, args[0]), qs._result_cache))
+        # Samme __-traversering som filterFunction, så props som 'kor__navn' også funke her
+        return list(map(lambda r: getByLookup(r, *args[0].split('__')), qs._result_cache))
 
     qs.filter = cacheDecorator(qs.filter, filterFunction)
     qs.values_list = cacheDecorator(qs.values_list, flatValuesListFunction)
@@ -1,18 +1,39 @@
+import contextlib
+import contextvars
 import datetime
+import operator
 import random
 import re
+from collections import defaultdict
+from functools import lru_cache, reduce
 
 from django.apps import apps
 from django.core.exceptions import FieldDoesNotExist
-from django.db.models import Q, Case, When, ManyToManyField, ManyToManyRel, ForeignObjectRel, Min
+from django.db.models import Q, Case, When, Count, Exists, IntegerField, ManyToManyField, ManyToManyRel, ForeignObjectRel, Min, OuterRef, Subquery, Value as V
+from django.db.models.functions import Cast, Length, Right, StrIndex, Substr
 from django.db.models.fields.related import RelatedField
 from django.forms import ValidationError
 from django.utils.translation import gettext_lazy as _
 
-from mytxs.utils.utils import getStemmegrupper
+from mytxs.utils.utils import getHalvårStart
 
 # Utils for modeller
 
+todayVar = contextvars.ContextVar('todayVar', default=None)
+'Dagens dato, satt en gang per request av TodayMiddleware så alle tilgangsqueryan i requesten dele dato'
+
+def getToday():
+    'Dagens dato fra todayVar om satt (i en request), ellers direkte fra datetime'
+    return todayVar.get() or datetime.date.today()
+
+
+@lru_cache(maxsize=32)
+def vervInnehavelseAktivKeys(pathToVervInnehavelse):
+    'Lookup-nøklan til vervInnehavelseAktiv, cachet så vi slipper tre f-strenger per kall på en hot path'
+    path = pathToVervInnehavelse + '__' if pathToVervInnehavelse else ''
+    return f'{path}start__lte', f'{path}slutt', f'{path}slutt__gte'
+
+
 def vervInnehavelseAktiv(pathToVervInnehavelse='vervInnehavelser', dato=None, utvidetStart=datetime.timedelta(), utvidetSlutt=datetime.timedelta()):
     '''
     Produsere et Q object som querye for aktive vervInnehavelser. Siden man 
@@ -30,32 +51,45 @@ def vervInnehavelseAktiv(pathToVervInnehavelse='vervInnehavelser', dato=None, ut
     - Tilgang.objects.filter(vervInnehavelseAktiv('verv__vervInnehavelser'))
     '''
 
-    # Må skriv dette fordi default parameters bare evalueres når funksjonen defineres. 
+    # Må skriv dette fordi default parameters bare evalueres når funksjonen defineres.
     # Altså om sørvern hadd kjørt meir enn en dag, og noen sende request, hadd de fått gårsdagens resultat.
-    # I dette tilfellet kunne det vært merkbart. 
+    # I dette tilfellet kunne det vært merkbart. getToday gjør i tillegg at alle kallan i samme
+    # request dele dato (og dermed cachet Q), også om requesten krysse midnatt.
     if dato == None:
-        dato = datetime.date.today()
+        dato = getToday()
+
+    return vervInnehavelseAktivQ(pathToVervInnehavelse, dato, utvidetStart, utvidetSlutt)
 
-    if pathToVervInnehavelse:
-        pathToVervInnehavelse += '__'
+
+@lru_cache(maxsize=128)
+def vervInnehavelseAktivQ(pathToVervInnehavelse, dato, utvidetStart, utvidetSlutt):
+    'Cachet bygging av Q-et til vervInnehavelseAktiv, deterministisk gitt argumentan'
+    startKey, sluttNullKey, sluttKey = vervInnehavelseAktivKeys(pathToVervInnehavelse)
 
     startQ, sluttQ = qBool(True), qBool(True)
 
     if utvidetStart != datetime.timedelta.max:
-        startQ = Q(**{f'{pathToVervInnehavelse}start__lte': dato + utvidetStart})
+        startQ = Q(**{startKey: dato + utvidetStart})
 
     if utvidetSlutt != datetime.timedelta.max:
-        sluttQ = Q(**{f'{pathToVervInnehavelse}slutt': None}) | Q(**{f'{pathToVervInnehavelse}slutt__gte': dato - utvidetSlutt})
+        sluttQ = Q(**{sluttNullKey: None}) | Q(**{sluttKey: dato - utvidetSlutt})
 
     return startQ & sluttQ
 
 
 stemmegruppeVervRegex = '^[12][12]?[SATB]$'
+'Som streng fordi navn__regex i ORMen treng en streng'
+
+stemmegruppeVervPattern = re.compile(stemmegruppeVervRegex)
+'Kompilert en gang sia isStemmegruppeVervNavn kjøre på hver Verv-lagring og i valideringer'
 
+@lru_cache(maxsize=64)
 def stemmegruppeVerv(pathToVerv='verv', includeUkjentStemmegruppe=True, includeDirr=False):
     '''
-    Produsere et Q objekt som querye for stemmegruppeverv
-    
+    Produsere et Q objekt som querye for stemmegruppeverv. Memoisert per argumentkombinasjon
+    sia den kalles på hvert tilgangs- og filteroppslag; deling e trygt sia Q-kombinering med
+    &/| lage nye objekt og ORMen kopiere under resolve_expression.
+
     Eksempel:
     - Verv.objects.filter(stemmegruppeVerv(''))
     - Medlem.objects.filter(stemmegruppeVerv('vervInnehavelser__verv'))
@@ -66,36 +100,48 @@ def stemmegruppeVerv(pathToVerv='verv', includeUkjentStemmegruppe=True, includeD
     if pathToVerv:
         pathToVerv += '__'
 
-    q = Q(**{f'{pathToVerv}navn__regex': stemmegruppeVervRegex})
-    
-    if includeUkjentStemmegruppe:
-        q |= Q(**{f'{pathToVerv}navn': 'ukjentStemmegruppe'})
-    
+    # Filtrere på den lagrede (og indekserte) boolen på Verv istedenfor regex på navn
+    q = Q(**{f'{pathToVerv}stemmegruppeVerv': True})
+
+    if not includeUkjentStemmegruppe:
+        q &= ~Q(**{f'{pathToVerv}navn': 'ukjentStemmegruppe'})
+
     if includeDirr:
         q |= Q(**{f'{pathToVerv}navn': 'Dirigent'})
-    
+
     return q
 
 
 def isStemmegruppeVervNavn(navn, includeUkjentStemmegruppe=True):
-    return re.match(stemmegruppeVervRegex, navn) or (includeUkjentStemmegruppe and navn == 'ukjentStemmegruppe')
+    return stemmegruppeVervPattern.match(navn) or (includeUkjentStemmegruppe and navn == 'ukjentStemmegruppe')
 
 
+@lru_cache(maxsize=None)
 def stemmegruppeOrdering(fieldName='navn'):
-    ordering = []
-    for stemmegruppe in getStemmegrupper('SATB', 2, 1):
-        ordering.append(When(**{fieldName: stemmegruppe}, then=len(ordering)))
-    return Case(*ordering, default=len(ordering))
+    '''
+    Returne et uttrykk som sortere stemmegruppenavn i getStemmegrupper('SATB', 2, 1) sin
+    rekkefølge (1S, 11S, 21S, 2S, 12S, 22S, 1A, ...), med alt annet sist. Istedenfor en CASE
+    med 24 WHEN-greininger regnes rangen aritmetisk fra navnet selv
+    (stemme * 6 + (hovedgruppe - 1) * 3 + eventuell undergruppe), så databasen
+    evaluere et lite uttrykk per rad. Deterministisk per fieldName, derav lru_cache.
+    '''
+    rang = (
+        (StrIndex(V('SATB'), Right(fieldName, 1)) - 1) * 6
+        + (Cast(Substr(fieldName, Length(fieldName) - 1, 1), IntegerField()) - 1) * 3
+        + Case(When(**{f'{fieldName}__regex': '^[12][12][SATB]$'}, then=Cast(Substr(fieldName, 1, 1), IntegerField())), default=0)
+    )
+    return Case(When(**{f'{fieldName}__regex': stemmegruppeVervRegex}, then=rang), default=24, output_field=IntegerField())
 
 
 def inneværendeSemester(pathToDate):
-    'Produsere et Q objekt som sjekke om en date e innafor inneværende semester'
-    today = datetime.date.today()
-    return Q(**{f'{pathToDate}__year': today.year}) & qBool(
-        today.month >= 7,
-        trueOption=Q(**{f'{pathToDate}__month__gte': 7}),
-        falseOption=Q(**{f'{pathToDate}__month__lt': 7})
-    )
+    '''
+    Produsere et Q objekt som sjekke om en date e innafor inneværende semester.
+    Rene datosammenligninger istedenfor __year/__month, så Postgres kan bruke
+    en index på datokolonnen som range scan istedenfor EXTRACT per rad.
+    '''
+    halvårStart = getHalvårStart()
+    halvårSlutt = halvårStart.replace(year=halvårStart.year + (halvårStart.month // 7), month=(halvårStart.month + 6) % 12)
+    return Q(**{f'{pathToDate}__gte': halvårStart}) & Q(**{f'{pathToDate}__lt': halvårSlutt})
 
 def groupBy(queryset, prop):
     '''
@@ -104,10 +150,12 @@ def groupBy(queryset, prop):
 
     TODO: Forbedre denne så den funke på remote felt
     '''
-    groups = dict()
-    for obj in queryset.all():
-        groups.setdefault(str(getattr(obj, prop)), []).append(obj)
-    return groups
+    # iterator() strømme radan i bulker istedenfor å materialisere hele querysettet i minnet,
+    # og defaultdict slipper setdefault sitt ekstra hash-oppslag per rad
+    groups = defaultdict(list)
+    for obj in queryset.iterator(chunk_size=2000):
+        groups[str(getattr(obj, prop))].append(obj)
+    return dict(groups)
 
 
 def randomDistinct(queryset, n=1, random=random):
@@ -119,69 +167,88 @@ def randomDistinct(queryset, n=1, random=random):
     - Kan ikke order_by('?') og distinct samtidig: https://docs.djangoproject.com/en/4.2/ref/models/querysets/#distinct
     - Burda ikkje order_by('?') generelt: https://stackoverflow.com/a/6405601/6709450
     '''
+    if n == 1:
+        # En COUNT + en OFFSET/LIMIT 1 query, istedenfor å frakte alle pk-an til appserveren.
+        # Eventuelle join-duplikater skjevfordele bare trekninga bittelitt, resultatet e fortsatt gyldig.
+        count = queryset.count()
+        if not count:
+            return None
+        return queryset[random.randrange(count)]
+
     pks = list(set(queryset.values_list('pk', flat=True)))
 
     # Shuffle pks for at vi skal få n tilfeldige elementer
     random.shuffle(pks)
     pks = pks[:n]
 
-    if n == 1:
-        return queryset.model.objects.filter(pk__in=pks).first()
-    else:
-        qs = list(queryset.model.objects.filter(pk__in=pks).all())
+    qs = list(queryset.model.objects.filter(pk__in=pks).all())
 
-        # Shuffle resultatet for at vi skal få tilfeldig sortering på elementan
-        random.shuffle(qs)
-        return qs
+    # Shuffle resultatet for at vi skal få tilfeldig sortering på elementan
+    random.shuffle(qs)
+    return qs
 
 
 def strToModels(modelNames):
     return list(map(lambda m: apps.get_model('mytxs', m), modelNames))
 
 
+# Disse e memoisert sia skjemaet e statisk for prosessen, så isinstance-skanninga av
+# _meta.get_fields() bare skjer en gang per modell (saveRelated kalle dem per lagring).
+
+@lru_cache(maxsize=None)
 def getAllRelatedModels(model):
-    # Returne en liste av alle (forwards og backwards) relaterte modeller 
-    return list(map(lambda f: f.related_model, filter(lambda f: isinstance(f, RelatedField) or isinstance(f, ForeignObjectRel), model._meta.get_fields())))
+    # Returne en liste av alle (forwards og backwards) relaterte modeller
+    return [f.related_model for f in model._meta.get_fields() if isinstance(f, (RelatedField, ForeignObjectRel))]
 
 
+@lru_cache(maxsize=None)
 def getAllRelatedModelsWithFieldName(model):
     # Returne samme som over, men istedet touples med (fieldNavn, model)
-    return [
-        *list(map(lambda f: (f.name, f.related_model), filter(lambda f: isinstance(f, RelatedField), model._meta.get_fields()))),
-        *list(map(lambda f: (f.related_name, f.related_model), filter(lambda f: isinstance(f, ForeignObjectRel), model._meta.get_fields())))
-    ]
+    forwards, backwards = [], []
+    for f in model._meta.get_fields():
+        if isinstance(f, RelatedField):
+            forwards.append((f.name, f.related_model))
+        elif isinstance(f, ForeignObjectRel):
+            backwards.append((f.related_name, f.related_model))
+    return forwards + backwards
 
 
+@lru_cache(maxsize=None)
 def getAllRelatedModelsWithFieldNameAndReverse(model):
     # Returne samme som over, men med relatedFieldNavn, altså (fieldNavn, relatedFieldNavn, model)
-    return [
-        *list(map(lambda f: (f.name, f._related_name, f.related_model), filter(lambda f: isinstance(f, RelatedField), model._meta.get_fields()))),
-        *list(map(lambda f: (f.related_name, f.field.name, f.related_model), filter(lambda f: isinstance(f, ForeignObjectRel), model._meta.get_fields())))
-    ]
-
+    forwards, backwards = [], []
+    for f in model._meta.get_fields():
+        if isinstance(f, RelatedField):
+            forwards.append((f.name, f._related_name, f.related_model))
+        elif isinstance(f, ForeignObjectRel):
+            backwards.append((f.related_name, f.field.name, f.related_model))
+    return forwards + backwards
+
+
+# Nøkla på modellnavn istedenfor klassen, så vi slipper sirkulær import av models
+pathToKorPerModel = {
+    'VervInnehavelse': 'verv__kor',
+    'DekorasjonInnehavelse': 'dekorasjon__kor',
+    'Oppmøte': 'hendelse__kor',
+    'Medlem': None,
+}
 
 def getPathToKor(model):
     'Returne lookup path til kor for denne modellen (funke ikkje på medlem)'
-    if model.__name__ == 'VervInnehavelse':
-        return 'verv__kor'
-    if model.__name__ == 'DekorasjonInnehavelse':
-        return 'dekorasjon__kor'
-    if model.__name__ == 'Oppmøte':
-        return 'hendelse__kor'
-    if model.__name__ == 'Medlem':
-        return None
-    
-    # Alle andre modeller kan anntas å ha en direkte relasjon til kor
-    return 'kor'
+    # Alle modeller utenom de i dicten kan anntas å ha en direkte relasjon til kor
+    return pathToKorPerModel.get(model.__name__, 'kor')
 
 
 def getInstancesForKor(model, kor):
     'Returne alle instanser av modellen for et queryset med kor'
     if model.__name__ == 'Medlem':
-        return model.objects.filter(
-            stemmegruppeVerv('vervInnehavelser__verv', includeDirr=True), 
-            vervInnehavelser__verv__kor__in=kor
-        )
+        # Korrelert Exists istedenfor join gjennom vervInnehavelser, så vi ikke produsere
+        # duplikatrader som måtte ryddes opp med distinct nedstrøms
+        return model.objects.filter(Exists(apps.get_model('mytxs', 'VervInnehavelse').objects.filter(
+            stemmegruppeVerv('verv', includeDirr=True),
+            verv__kor__in=kor,
+            medlem=OuterRef('pk')
+        )))
     
     if model.__name__ == 'Kor':
         return kor
@@ -197,19 +264,14 @@ def validateStartSlutt(instance, canEqual=True):
     Skriver hjelpefunksjon fordi dette trengs i clean på tvers av flere modeller. 
     Gjør ingenting om instance.slutt ikke er satt. 
     '''
-    if instance.slutt:
-        if canEqual:
-            if instance.start >= instance.slutt:
-                raise ValidationError(
-                    _('Slutt må være etter eller lik start'),
-                    code='invalidDateOrder'
-                )
-        else:
-            if instance.start > instance.slutt:
-                raise ValidationError(
-                    _('Slutt må være etter start'),
-                    code='invalidDateOrder'
-                )
+    if not instance.slutt:
+        return
+
+    if (instance.start >= instance.slutt) if canEqual else (instance.start > instance.slutt):
+        raise ValidationError(
+            _('Slutt må være etter eller lik start') if canEqual else _('Slutt må være etter start'),
+            code='invalidDateOrder'
+        )
 
 
 def validateM2MFieldEmpty(instance, *fieldNames):
@@ -217,8 +279,14 @@ def validateM2MFieldEmpty(instance, *fieldNames):
     Gitt en liste av M2M fields sjekke denne om noen har relaterte instances, og raise isåfall ValidationError
     Tiltenkt å settes inn i delete override der vi har M2M fields vi skulle likt å si on_delete=models.PROTECT
     '''
+    # En aggregate-query for alle feltan istedenfor en exists per felt. Vi bruke bare
+    # sannhetsverdien, så at kryssjoins kan blåse opp antallan gjør ingenting.
+    antallRelaterte = type(instance).objects.filter(pk=instance.pk).aggregate(
+        **{fieldName: Count(fieldName) for fieldName in fieldNames}
+    )
+
     for fieldName in fieldNames:
-        if getattr(instance, fieldName).exists():
+        if antallRelaterte[fieldName]:
             raise ValidationError(
                 _('For å slette denne instansen må du fjerne alle M2M relasjoner.'),
                 code='nonEmptyM2M'
@@ -250,24 +318,29 @@ def joinQ(*Qs, joinOp='|'):
     '''
     Slår sammen en liste av Q objekt med operator
     
-    Default joinOp er OR fordi om man treng AND kan man bare spre Q objektan inn i filteret. 
+    Default joinOp er OR fordi om man treng AND kan man bare spre Q objektan inn i filteret.
+
+    qTrue/qFalse-sentinelan fra qBool kortsluttes i python (absorbering og identitet), så de
+    trivielle greinan aldri når SQLen. Tom OR matche ingenting, tom AND matche alt.
     '''
-    if len(Qs) == 1:
-        return Qs[0]
-    
-    resQ = Qs.pop()
+    if joinOp == '|':
+        if any(q is qTrue for q in Qs):
+            return qTrue
+        Qs = [q for q in Qs if q is not qFalse]
+        return reduce(operator.or_, Qs) if Qs else qFalse
 
-    while len(resQ) > 0:
-        if joinOp == '|':
-            resQ |= Qs.pop()
-        else:
-            resQ |= Qs.pop()
-    
-    return resQ
+    if any(q is qFalse for q in Qs):
+        return qFalse
+    Qs = [q for q in Qs if q is not qTrue]
+    return reduce(operator.and_, Qs) if Qs else qTrue
 
 
+@lru_cache(maxsize=None)
 def getSourceM2MModel(model, fieldName):
-    'Gitt en av modellene og et fieldName skaffer denne modellen som m2m feltet står på'
+    '''
+    Gitt en av modellene og et fieldName skaffer denne modellen som m2m feltet står på.
+    Memoisert sia skjemaet e statisk og formAccess spør for samme felt om og om igjen.
+    '''
     try:
         modelFieldOrRel = model._meta.get_field(fieldName)
         if isinstance(modelFieldOrRel, ManyToManyField):
@@ -280,32 +353,55 @@ def getSourceM2MModel(model, fieldName):
         return None
 
 
+@lru_cache(maxsize=8)
+def aktivtStemmegruppeMedlemQ(dato, includeDirr):
+    'Se aktiveStemmegruppeMedlemmer, cachet per (dato, includeDirr)'
+    return vervInnehavelseAktiv(dato=dato) & stemmegruppeVerv('vervInnehavelser__verv', includeDirr=includeDirr)
+
+
+def aktiveStemmegruppeMedlemmer(dato=None, includeDirr=False):
+    '''
+    Kombinert Q for medlemmer med aktivt stemmegruppeverv på datoen, til bruk der man ellers
+    hadde stava ut både vervInnehavelseAktiv() og stemmegruppeVerv('vervInnehavelser__verv').
+    '''
+    if dato == None:
+        dato = getToday()
+    return aktivtStemmegruppeMedlemQ(dato, includeDirr)
+
+
 def bareAktiveDecorator(func):
     'Legges før sideTilgangQueryset og redigerTilgangQueryset for å implementere bareAktive innstillingen'
     def _decorator(self, *args, **kwargs):
         qs = func(self, *args, **kwargs)
 
         if qs.model.__name__ == 'Medlem' and self.innstillinger.get('bareAktive', False):
-            qs = qs.filter(vervInnehavelseAktiv(), stemmegruppeVerv('vervInnehavelser__verv', includeDirr=True))
+            qs = qs.filter(aktiveStemmegruppeMedlemmer(includeDirr=True))
         return qs
 
     return _decorator
 
 
+@lru_cache(maxsize=64)
+def korLookupKeys(path):
+    'Lookup-nøklan til korLookup, cachet per path som i vervInnehavelseAktivKeys'
+    return path + '__navn', path + '__navn__in', path + '__in'
+
+
 def korLookup(kor, path=''):
     '''
     Returne et Q lookup for å spør om kor=kor, der vi
     - Legg på __navn=kor dersom kor er en string.
     - Legg på __in=kor dersom kor er en liste, både av string og ikke.
     '''
+    navnKey, navnInKey, inKey = korLookupKeys(path)
     if isinstance(kor, str):
-        return Q(**{path+'__navn': kor})
+        return Q(**{navnKey: kor})
     if isinstance(kor, list):
         if len(kor) == 0:
             return qBool(False)
         if isinstance(kor[0], str):
-            return Q(**{path+'__navn__in': kor})
-        return Q(**{path+'__in': kor})
+            return Q(**{navnInKey: kor})
+        return Q(**{inKey: kor})
     return Q(**{path: kor})
 
 
@@ -319,12 +415,45 @@ def annotateInstance(instance, annotateFunction, *args, **kwargs):
     på annotation navnet. 
     '''
     annotatedQS = annotateFunction(type(instance).objects.filter(pk=instance.pk), *args, **kwargs)
-    annotatedInstance = annotatedQS.first()
+    annotationNames = list(annotatedQS.query.annotations)
+
+    if not annotationNames:
+        return
 
-    for name in annotatedQS.query.annotations.keys():
-        setattr(instance, name, getattr(annotatedInstance, name, None))
+    # Hent bare annotation-kolonnan istedenfor å hydrere en hel modellinstans vi bare kopiere av
+    rad = annotatedQS.values(*annotationNames).first() or {}
+
+    for name in annotationNames:
+        setattr(instance, name, rad.get(name))
 
 
 def refreshQueryset(queryset):
-    'En quick fix funksjon som hindrer at filters ikkje kombineres på uintensjonelle måter.'
-    return queryset.model.objects.filter(pk__in=queryset.values_list('pk', flat=True))
+    '''
+    En quick fix funksjon som hindrer at filters ikkje kombineres på uintensjonelle måter.
+    Subquery garantere at pk-an forblir en IN (SELECT ...) i databasen, istedenfor at et
+    evaluert queryset frakte alle pk-an gjennom python. Ikke kall .all() på resultatet.
+    '''
+    return queryset.model.objects.filter(pk__in=Subquery(queryset.values('pk')))
+
+
+oldSelfCache = contextvars.ContextVar('oldSelfCache', default=None)
+
+@contextlib.contextmanager
+def preloadOldSelves(queryset):
+    '''
+    Forhåndshent oldSelf for save() når man lagre mange instanser (typ et formset), så
+    ikke hver save() gjør sitt eget pk-oppslag. Modellenes save() leser cachen via getOldSelf.
+    '''
+    token = oldSelfCache.set({(type(instance), instance.pk): instance for instance in queryset})
+    try:
+        yield
+    finally:
+        oldSelfCache.reset(token)
+
+
+def getOldSelf(instance):
+    'Skaff forrige lagrede versjon av instansen, fra preloadOldSelves-cachen dersom den e satt'
+    cache = oldSelfCache.get()
+    if cache != None:
+        return cache.get((type(instance), instance.pk))
+    return type(instance).objects.filter(pk=instance.pk).first()
@@ -27,7 +27,7 @@ from mytxs.utils.googleCalendar import getOrCreateAndShareCalendar
 from mytxs.utils.lazyDropdown import lazyDropdown
 from mytxs.utils.formUtils import filesIfPost, postIfPost, inlineFormsetArgs
 from mytxs.utils.hashUtils import addHash, testHash
-from mytxs.utils.modelUtils import inneværendeSemester, korLookup, qBool, randomDistinct, stemmegruppeOrdering, vervInnehavelseAktiv, stemmegruppeVerv, annotateInstance
+from mytxs.utils.modelUtils import aktiveStemmegruppeMedlemmer, inneværendeSemester, korLookup, preloadOldSelves, qBool, randomDistinct, stemmegruppeOrdering, vervInnehavelseAktiv, stemmegruppeVerv, annotateInstance
 from mytxs.utils.pagination import getPaginatedInlineFormSet, addPaginatorPage
 from mytxs.utils.downloadUtils import downloadFile, downloadICal, downloadVCard
 from mytxs.utils.utils import getHalvårStart
@@ -149,8 +149,7 @@ def endreLogin(request):
 def sjekkheftet(request, side, underside=None):
     if side == 'søk':
         request.queryset = Medlem.objects.distinct().annotateKarantenekor(storkor=True).filter(
-            vervInnehavelseAktiv(),
-            stemmegruppeVerv('vervInnehavelser__verv')
+            aktiveStemmegruppeMedlemmer()
         )
 
         medlemFilterForm = MedlemFilterForm(request.GET)
@@ -175,8 +174,7 @@ def sjekkheftet(request, side, underside=None):
             'storkorNavn': medlem.storkorNavn(),
             'pk': medlem.pk
         } for medlem in Medlem.objects.distinct().filter(
-            vervInnehavelseAktiv(),
-            stemmegruppeVerv('vervInnehavelser__verv')
+            aktiveStemmegruppeMedlemmer()
         ).annotatePublic().exclude(public__boAdresse__isnull=True, public__foreldreAdresse__isnull=True)])
 
         return render(request, 'mytxs/sjekkhefteKart.html')
@@ -184,8 +182,7 @@ def sjekkheftet(request, side, underside=None):
     if side == 'sjekkhefTest':
         request.queryset = randomDistinct(
             Medlem.objects.filter(
-                vervInnehavelseAktiv(),
-                stemmegruppeVerv('vervInnehavelser__verv'),
+                aktiveStemmegruppeMedlemmer(),
                 ~Q(bilde='')
             ), 20
         )
@@ -233,8 +230,7 @@ def sjekkheftet(request, side, underside=None):
 
     elif side == 'jubileum':
         request.queryset = Medlem.objects.distinct().annotateKarantenekor(storkor=True).annotatePublic().filter(
-            vervInnehavelseAktiv(), 
-            stemmegruppeVerv('vervInnehavelser__verv'),
+            aktiveStemmegruppeMedlemmer(),
             public__fødselsdato__isnull=False
         )
 
@@ -428,6 +424,12 @@ def semesterplan(request, kor):
     if request.GET.get('utenUndergruppe'):
         request.queryset = request.queryset.exclude(kategori=Hendelse.UNDERGRUPPE)
 
+    # Prefetch medlemmets oppmøter så templaten (filterMedlemFirst og fraværTekst) ikke
+    # hitte databasen per hendelse. Prefetchen sette også hendelse-referansen på oppmøtan.
+    request.queryset = request.queryset.prefetch_related(
+        Prefetch('oppmøter', queryset=Oppmøte.objects.filter(medlem=request.user.medlem))
+    )
+
     request.iCalLink = 'http://' + request.get_host() + addHash(reverse('iCal', args=[kor, request.user.medlem.pk]))
 
     annotateInstance(request.user.medlem, MedlemQuerySet.annotateFravær, kor=kor)
@@ -538,8 +540,7 @@ def fraværSide(request, side, underside=None):
 
     if side == 'oversikt' or side == 'statistikk':
         request.queryset = Medlem.objects.filter(
-            vervInnehavelseAktiv(),
-            stemmegruppeVerv('vervInnehavelser__verv', includeDirr=True),
+            aktiveStemmegruppeMedlemmer(includeDirr=True),
             korLookup(underside, 'vervInnehavelser__verv__kor'),
         ).annotateFravær(
             kor=underside, 
@@ -745,8 +746,10 @@ def hendelse(request, hendelsePK):
                 disableFields(oppmøteFormset, 'fravær')
 
             addHelpText(oppmøteFormset, 'DELETE', helpText='Dette oppmøtet ble ikke slettet automatisk pga data, slett det gjerne manuelt.')
+            # Materialiser pk-an en gang istedenfor en contains-query per form
+            oppmøteMedlemPKs = set(oppmøteFormset.instance.oppmøteMedlemmer.values_list('pk', flat=True))
             for form in oppmøteFormset.forms:
-                if form.instance.medlem in oppmøteFormset.instance.oppmøteMedlemmer:
+                if form.instance.medlem_id in oppmøteMedlemPKs:
                     removeFields(form, 'DELETE')
         else:
             removeFields(oppmøteFormset, 'DELETE')
@@ -754,7 +757,9 @@ def hendelse(request, hendelsePK):
     if request.method == 'POST':
         # Rekkefølgen her e viktig for at bruker skal kunne slette oppmøter nødvendig for å flytte hendelse på en submit:)
         if oppmøteFormset and oppmøteFormset.is_valid():
-            oppmøteFormset.save()
+            # Forhåndshent oldSelf for alle oppmøtan, så ikke hver Oppmøte.save gjør sitt eget oppslag
+            with preloadOldSelves(request.instance.oppmøter.all()):
+                oppmøteFormset.save()
         if hendelseForm.is_valid():
             hendelseForm.save()
             if hendelseForm.cleaned_data['DELETE']:
@@ -779,7 +784,8 @@ def hendelse(request, hendelsePK):
 @harTilgang
 def lenker(request):
     request.queryset = Lenke.objects.distinct().filter(
-        Q(kor__in=request.user.medlem.aktiveKor) | Q(kor__navn=consts.Kor.Sangern), 
+        # list() så vi bruke de allerede hentede korene, istedenfor at aktiveKor-queryen kjøres på nytt som subquery
+        Q(kor__in=list(request.user.medlem.aktiveKor)) | Q(kor__navn=consts.Kor.Sangern), 
         synlig=True
     )
 
@@ -1079,7 +1085,7 @@ def eksport(request, kor):
 
     class EksportForm(forms.Form):
         # Medlemmer og felt forkortet til m og f for å lage kortere urler
-        m = forms.ModelMultipleChoiceField(required=False, label='Medlemmer', queryset=Medlem.objects.filter(vervInnehavelseAktiv(), stemmegruppeVerv('vervInnehavelser__verv', includeDirr=True), vervInnehavelser__verv__kor__navn=kor).distinct())
+        m = forms.ModelMultipleChoiceField(required=False, label='Medlemmer', queryset=Medlem.objects.filter(aktiveStemmegruppeMedlemmer(includeDirr=True), vervInnehavelser__verv__kor__navn=kor).distinct())
         f = forms.MultipleChoiceField(required=False, label='Felt', choices=[(o, o) for o in supportedFields])
 
     eksportForm = EksportForm(request.GET)